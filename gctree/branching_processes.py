@@ -11,13 +11,14 @@ from gctree.phylip_parse import disambiguate
 
 from frozendict import frozendict
 import pandas as pd
-import seaborn as sns
 import numpy as np
 import warnings
 import random
 import os
+import sys
 import scipy.special as scs
 import scipy.optimize as sco
+import scipy.sparse as scsp
 import ete3
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
@@ -26,12 +27,13 @@ from Bio.Phylo.TreeConstruction import MultipleSeqAlignment
 import pickle
 import functools
 import collections as coll
+import concurrent.futures as cf
 import historydag as hdag
 import multiset
-import matplotlib as mp
-import matplotlib.pyplot as plt
 from typing import Tuple, Dict, List, Union, Set, Callable, Mapping, Sequence, Optional
-from decimal import Decimal
+
+# Shared by all DAG nodes without isotype annotations
+_EMPTY_FROZENDICT = frozendict()
 
 
 class CollapsedTree:
@@ -50,6 +52,13 @@ class CollapsedTree:
     """
 
     _max_ll_cache: Dict[Tuple[float, float], Tuple[int, int]] = {}
+    # Number of (p, q) pairs whose _ll_genotype values are kept cached, so
+    # that returning to recent parameters (e.g. from gradient checks, or to the
+    # MLE after optimization) doesn't rebuild the cache.
+    _max_ll_cache_params: int = 8
+    # Optional mapping of taxon names to distinct powers of two, shared by all
+    # trees in a :class:`CollapsedForest`, used for comparing splits.
+    _taxon_bit: Optional[Dict[str, int]] = None
 
     def __init__(
         self, tree: Optional[ete3.TreeNode] = None, allow_repeats: bool = False
@@ -278,9 +287,10 @@ class CollapsedTree:
         if (p, q) in CollapsedTree._max_ll_cache:
             cached_c, cached_m = CollapsedTree._max_ll_cache[(p, q)]
         else:
-            # clear cache for old parameters if parameters change:
-            CollapsedTree._max_ll_cache = {}
-            CollapsedTree._ll_genotype.cache_clear()
+            # clear cache for old parameters once too many have been used:
+            if len(CollapsedTree._max_ll_cache) >= CollapsedTree._max_ll_cache_params:
+                CollapsedTree._max_ll_cache = {}
+                CollapsedTree._ll_genotype.cache_clear()
             cached_c, cached_m = 0, 0
         # Check cache is built
         if c > cached_c or m > cached_m:
@@ -338,29 +348,47 @@ class CollapsedTree:
                 logg_array = []
                 dloggdp_array = []
                 dloggdq_array = []
-            for cx in range(c + 1):
-                for mx in range(m + 1):
-                    if (cx > 0 or mx > 1) and (c - cx > 0 or m - mx > 1):
-                        (
-                            neighbor1_ll_genotype,
-                            (neighbor1_dlogfdp, neighbor1_dlogfdq),
-                        ) = CollapsedTree._ll_genotype(cx, mx, p, q)
-                        (
-                            neighbor2_ll_genotype,
-                            (neighbor2_dlogfdp, neighbor2_dlogfdq),
-                        ) = CollapsedTree._ll_genotype(c - cx, m - mx, p, q)
-                        logg = (
-                            np.log(p)
-                            + 2 * np.log(1 - q)
-                            + neighbor1_ll_genotype
-                            + neighbor2_ll_genotype
-                        )
-                        dloggdp = 1 / p + neighbor1_dlogfdp + neighbor2_dlogfdp
-                        dloggdq = -2 / (1 - q) + neighbor1_dlogfdq + neighbor2_dlogfdq
-                        logg_array.append(logg)
-                        dloggdp_array.append(dloggdp)
-                        dloggdq_array.append(dloggdq)
-            if not logg_array:
+            # Combine all pairs of subtrees at once, from the cached values
+            splits = [
+                (cx, mx)
+                for cx in range(c + 1)
+                for mx in range(m + 1)
+                if (cx > 0 or mx > 1) and (c - cx > 0 or m - mx > 1)
+            ]
+            if splits:
+                neighbor1s = [
+                    CollapsedTree._ll_genotype(cx, mx, p, q) for cx, mx in splits
+                ]
+                neighbor2s = [
+                    CollapsedTree._ll_genotype(c - cx, m - mx, p, q)
+                    for cx, mx in splits
+                ]
+                neighbor1_ll_genotype = np.array([ll for ll, _ in neighbor1s])
+                neighbor2_ll_genotype = np.array([ll for ll, _ in neighbor2s])
+                neighbor1_grad = np.array([grad for _, grad in neighbor1s])
+                neighbor2_grad = np.array([grad for _, grad in neighbor2s])
+                logg_array = np.concatenate(
+                    (
+                        logg_array,
+                        np.log(p)
+                        + 2 * np.log(1 - q)
+                        + neighbor1_ll_genotype
+                        + neighbor2_ll_genotype,
+                    )
+                )
+                dloggdp_array = np.concatenate(
+                    (
+                        dloggdp_array,
+                        1 / p + neighbor1_grad[:, 0] + neighbor2_grad[:, 0],
+                    )
+                )
+                dloggdq_array = np.concatenate(
+                    (
+                        dloggdq_array,
+                        -2 / (1 - q) + neighbor1_grad[:, 1] + neighbor2_grad[:, 1],
+                    )
+                )
+            if not len(logg_array):
                 raise ValueError("Zero likelihood event")
             else:
                 logf_result = scs.logsumexp(logg_array)
@@ -659,7 +687,9 @@ class CollapsedTree:
         Returns:
             Dictionary of node names to hex color strings, which may be used as the colormap in :meth:`gctree.CollapsedTree.render`
         """
-        cmap = mp.cm.get_cmap(cmap)
+        from matplotlib import cm, colors
+
+        cmap = cm.get_cmap(cmap)
 
         if vmin is None:
             vmin = np.nanmin([getattr(node, feature) for node in self.tree.traverse()])
@@ -667,16 +697,16 @@ class CollapsedTree:
             vmax = np.nanmax([getattr(node, feature) for node in self.tree.traverse()])
 
         if scale == "linear":
-            norm = mp.colors.Normalize(vmin=vmin, vmax=vmax)
+            norm = colors.Normalize(vmin=vmin, vmax=vmax)
         elif scale == "log":
-            norm = mp.colors.LogNorm(vmin=vmin, vmax=vmax)
+            norm = colors.LogNorm(vmin=vmin, vmax=vmax)
         elif scale == "symlog":
-            norm = mp.colors.SymLogNorm(vmin=vmin, vmax=vmax, **kwargs)
+            norm = colors.SymLogNorm(vmin=vmin, vmax=vmax, **kwargs)
         else:
             raise ValueError(f"unrecognize scale: {scale}")
 
         return {
-            node.name: mp.colors.to_hex(cmap(norm(getattr(node, feature))))
+            node.name: colors.to_hex(cmap(norm(getattr(node, feature))))
             for node in self.tree.traverse()
         }
 
@@ -736,18 +766,33 @@ class CollapsedTree:
             n_taxa = len(taxa)
             d = np.zeros(shape=(n_taxa, n_taxa))
             sum_sites = np.zeros(shape=(n_taxa, n_taxa))
+
+            def ancestor_paths(tree):
+                # path from the first node with each taxon sequence to the root
+                seq_nodes = {}
+                for node in tree.traverse():
+                    seq_nodes.setdefault(node.sequence, node)
+                paths = []
+                for sequence in taxa:
+                    node = seq_nodes[sequence]
+                    path = [node]
+                    while node.up is not None:
+                        node = node.up
+                        path.append(node)
+                    paths.append((path, set(path)))
+                return paths
+
+            def mrca_sequence(path_i, path_j):
+                path, _ = path_i
+                _, ancestors = path_j
+                return next(node for node in path if node in ancestors).sequence
+
+            paths_true = ancestor_paths(self.tree)
+            paths = ancestor_paths(tree2.tree)
             for i in range(n_taxa):
-                nodei_true = self.tree.iter_search_nodes(sequence=taxa[i]).__next__()
-                nodei = tree2.tree.iter_search_nodes(sequence=taxa[i]).__next__()
                 for j in range(i + 1, n_taxa):
-                    nodej_true = self.tree.iter_search_nodes(
-                        sequence=taxa[j]
-                    ).__next__()
-                    nodej = tree2.tree.iter_search_nodes(sequence=taxa[j]).__next__()
-                    MRCA_true = self.tree.get_common_ancestor(
-                        (nodei_true, nodej_true)
-                    ).sequence
-                    MRCA = tree2.tree.get_common_ancestor((nodei, nodej)).sequence
+                    MRCA_true = mrca_sequence(paths_true[i], paths_true[j])
+                    MRCA = mrca_sequence(paths[i], paths[j])
                     d[i, j] = gctree.utils.hamming_distance(MRCA_true, MRCA)
                     sum_sites[i, j] = len(MRCA_true)
             return d.sum() / sum_sites.sum()
@@ -769,62 +814,64 @@ class CollapsedTree:
         else:
             raise ValueError("invalid distance method: " + method)
 
-    def _get_split(self, node: ete3.TreeNode) -> Tuple[Set, Set]:
-        r"""Return the bipartition resulting from clipping this node's edge
-        above.
+    def _taxa(self) -> Set[str]:
+        r"""Return the names of all observed taxa in the tree, including the
+        root."""
+        return set(
+            name
+            for node in self.tree.traverse()
+            if node.abundance > 0 or node == self.tree
+            for name in ((node.name,) if isinstance(node.name, str) else node.name)
+        )
+
+    def _all_splits(
+        self, taxon_bit: Mapping[str, int]
+    ) -> Dict[ete3.TreeNode, Tuple[int, int]]:
+        r"""Return the bipartitions resulting from clipping each non-root
+        node's edge above, computed in a single postorder traversal.
 
         Args:
-            node: tree node
+            taxon_bit: mapping of taxon names to distinct powers of two, which must contain all taxa in the tree
 
         Returns:
-            A tuple of two sets
+            A dictionary keyed by non-root nodes, containing tuples of two taxon bitmasks:
+            the taxa below the node, and the rest of the taxa
         """
-        if node.get_tree_root() != self.tree:
-            raise ValueError("node not found")
-        if node == self.tree:
-            raise ValueError("this node is the root (no split above)")
-        parent = node.up
-        taxa1 = []
-        for node2 in node.traverse():
-            if node2.abundance > 0 or node2 == self.tree:
-                if isinstance(node2.name, str):
-                    taxa1.append(node2.name)
-                else:
-                    taxa1.extend(node2.name)
-        taxa1 = set(taxa1)
-        node.detach()
-        taxa2 = []
-        for node2 in self.tree.traverse():
-            if node2.abundance > 0 or node2 == self.tree:
-                if isinstance(node2.name, str):
-                    taxa2.append(node2.name)
+        taxa_below = {}
+        for node in self.tree.traverse(strategy="postorder"):
+            taxa = 0
+            if node.abundance > 0 or node == self.tree:
+                if isinstance(node.name, str):
+                    taxa = taxon_bit[node.name]
                 else:
-                    taxa2.extend(node2.name)
-        taxa2 = set(taxa2)
-        parent.add_child(node)
-        assert taxa1.isdisjoint(taxa2)
-        assert taxa1.union(taxa2) == set(
-            (
-                name
-                for node in self.tree.traverse()
-                if node.abundance > 0 or node == self.tree
-                for name in ((node.name,) if isinstance(node.name, str) else node.name)
-            )
-        )
-        return tuple(sorted([taxa1, taxa2]))
+                    for name in node.name:
+                        taxa |= taxon_bit[name]
+            for child in node.children:
+                assert not taxa & taxa_below[child]
+                taxa |= taxa_below[child]
+            taxa_below[node] = taxa
+        all_taxa = taxa_below.pop(self.tree)
+        return {node: (taxa, all_taxa ^ taxa) for node, taxa in taxa_below.items()}
 
     @staticmethod
-    def _split_compatibility(split1, split2):
-        diff = split1[0].union(split1[1]) ^ split2[0].union(split2[1])
+    def _split_compatibility(
+        split1: Tuple[int, int],
+        split2: Tuple[int, int],
+        taxon_bit: Mapping[str, int],
+    ) -> bool:
+        diff = (split1[0] | split1[1]) ^ (split2[0] | split2[1])
         if diff:
+            diff_taxa = {name for name, bit in taxon_bit.items() if diff & bit}
             raise ValueError(
-                "splits do not cover the same taxa\n" f"\ttaxa not in both: {diff}"
+                "splits do not cover the same taxa\n" f"\ttaxa not in both: {diff_taxa}"
             )
-        for partition1 in split1:
-            for partition2 in split2:
-                if partition1.isdisjoint(partition2):
-                    return True
-        return False
+        # compatible if some pair of partitions shares no taxa
+        return not (
+            split1[0] & split2[0]
+            and split1[0] & split2[1]
+            and split1[1] & split2[0]
+            and split1[1] & split2[1]
+        )
 
     def support(
         self,
@@ -840,28 +887,31 @@ class CollapsedTree:
             weights: weights for each tree, perhaps for weighting parsimony degenerate trees
             compatibility: counts trees that don't disconfirm the split.
         """
-        for node in self.tree.get_descendants():
-            split = self._get_split(node)
+        # splits are compared as integer bitmasks of taxa rather than sets of
+        # names. Reuse this tree's taxon bits if they cover all taxa involved.
+        taxa = self._taxa().union(*(tree._taxa() for tree in bootstrap_trees_list))
+        if self._taxon_bit is not None and taxa.issubset(self._taxon_bit):
+            taxon_bit = self._taxon_bit
+        else:
+            taxon_bit = {name: 1 << i for i, name in enumerate(sorted(taxa))}
+        # each bootstrap tree's splits are computed once, not once per node
+        boot_splits_list = [
+            set(tree._all_splits(taxon_bit).values()) for tree in bootstrap_trees_list
+        ]
+        for node, split in self._all_splits(taxon_bit).items():
             support = 0
-            compatibility_ = 0
-            for i, tree in enumerate(bootstrap_trees_list):
-                compatible = True
-                supported = False
-                for boot_node in tree.tree.get_descendants():
-                    boot_split = tree._get_split(boot_node)
-                    if (
-                        compatibility
-                        and compatible
-                        and not self._split_compatibility(split, boot_split)
-                    ):
-                        compatible = False
-                    if not compatibility and not supported and boot_split == split:
-                        supported = True
-                if supported:
+            for i, boot_splits in enumerate(boot_splits_list):
+                if compatibility:
+                    # stops at the first bootstrap split that disconfirms
+                    counted = all(
+                        self._split_compatibility(split, boot_split, taxon_bit)
+                        for boot_split in boot_splits
+                    )
+                else:
+                    counted = split in boot_splits
+                if counted:
                     support += weights[i] if weights is not None else 1
-                if compatible:
-                    compatibility_ += weights[i] if weights is not None else 1
-            node.support = compatibility_ if compatibility else support
+            node.support = support
 
     def local_branching(
         self, tau=1, tau0=1, infinite_root_branch=True, nan_root_lbr=False
@@ -946,11 +996,20 @@ class CollapsedForest:
 
     Args:
         forest: list of :class:`ete3.Tree`
+        workers: maximum number of worker processes used to disambiguate ambiguous leaf sequences.
+            By default this is done serially. Using more than one worker starts a process pool, so
+            scripts doing so must guard their entry point with ``if __name__ == "__main__":`` on
+            platforms that spawn processes.
     """
 
+    # Defaults for forests pickled before these attributes were added
+    _taxon_bit: Optional[Dict[str, int]] = None
+    _cm_table: Optional[Tuple] = None
+
     def __init__(
         self,
         forest: Optional[List[Union[CollapsedTree, ete3.Tree]]] = None,
+        workers: int = 1,
     ):
         if forest is not None:
             if len(forest) == 0:
@@ -978,16 +1037,21 @@ class CollapsedForest:
             }
             if not any(_is_ambiguous(key) for key in leaf_seqs):
                 self._validation_stats["leaf_seqs"] = leaf_seqs
+            # A fixed bit for each observed taxon, shared by all trees in the
+            # forest, for comparing splits
+            self._taxon_bit = {name: 1 << i for i, name in enumerate(sorted(counts))}
             # Making this a private variable so that trying to access forest
             # attribute as before won't just give a confusing type or
             # attribute error.
-            self._forest = _make_dag(forest)
+            self._forest = _make_dag(forest, workers=workers)
             self.n_trees = self._forest.count_trees()
         else:
             self._forest = None
             self.n_trees = 0
             self._validation_stats = None
+            self._taxon_bit = None
         self._cm_countlist = None
+        self._cm_table = None
         self._ctrees = None
         self.parameters = None
         self.is_isotyped = False
@@ -1066,13 +1130,38 @@ class CollapsedForest:
             else:
                 raise ValueError("forest data must be defined to compute likelihood")
 
-        terms = [
-            [_lltree(cmcounts, p, q), count] for cmcounts, count in self._cm_countlist
-        ]
-        ls = np.array([term[0][0] for term in terms])
-        grad_ls = np.array([term[0][1] for term in terms])
-        # This can be done ahead of time
-        count_ls = np.array([term[1] for term in terms])
+        # Each distinct (c, m) pair is evaluated once for the whole forest,
+        # rather than once for every tree it appears in, and the results are
+        # combined for each tree using a sparse matrix of (c, m) counts.
+        # The table only depends on _cm_countlist, so it's reused across
+        # calls (e.g. optimizer iterations) until _cm_countlist is replaced.
+        if self._cm_table is None or self._cm_table[0] is not self._cm_countlist:
+            cm_index = {}
+            rows, cols, cm_mults = [], [], []
+            for row, (cmcounts, _) in enumerate(self._cm_countlist):
+                for cm, n in cmcounts:
+                    rows.append(row)
+                    cols.append(cm_index.setdefault(cm, len(cm_index)))
+                    cm_mults.append(n)
+            cm_count_matrix = scsp.csr_matrix(
+                (cm_mults, (rows, cols)),
+                shape=(len(self._cm_countlist), len(cm_index)),
+                dtype=np.float64,
+            )
+            count_ls = np.array([count for _, count in self._cm_countlist])
+            self._cm_table = (
+                self._cm_countlist,
+                tuple(cm_index),
+                cm_count_matrix,
+                count_ls,
+            )
+        _, cms, cm_count_matrix, count_ls = self._cm_table
+        logf_arr = np.empty(len(cms))
+        grad_arr = np.empty((len(cms), 2))
+        for i, (c, m) in enumerate(cms):
+            logf_arr[i], grad_arr[i] = CollapsedTree._ll_genotype(c, m, p, q)
+        ls = cm_count_matrix @ logf_arr
+        grad_ls = cm_count_matrix @ grad_arr
         if marginal:
             # we need to find the smallest derivative component for each
             # coordinate, then subtract off to get positive things to logsumexp
@@ -1152,7 +1241,8 @@ class CollapsedForest:
             verbose: print information about trimming
             outbase: file name stem for a file with information for each tree in the DAG.
             summarize_forest: whether to write a summary of the forest to file `[outbase].forest_summary.log`
-            tree_stats: whether to write stats for each tree in the forest to file `[outbase].tree_stats.log`
+            tree_stats: whether to write stats for the trees in the forest to file `[outbase].tree_stats.csv`,
+                with one row for each distinct tuple of tree weights, and the number of trees sharing it
 
         Returns:
             The trimmed forest, containing all optimal trees according to the specified criteria, and a tuple
@@ -1325,21 +1415,39 @@ class CollapsedForest:
                 )
 
         if tree_stats:
-            dag_ls = list(dag.weight_count(**dagweight_kwargs).elements())
+            # Many trees share the same weight tuple, so we keep one row per
+            # distinct tuple, with the number of trees having it.
+            dag_weightcounts = dag.weight_count(**dagweight_kwargs)
             # To clear _dp_data fields of their large cargo
             dag.optimal_weight_annotate(edge_weight_func=lambda n1, n2: 0)
-            dag_ls.sort(key=minfunckey)
+            dag_ls = list(dag_weightcounts.keys())
+            # Sort with the same ordering as minfunckey, but computed on an
+            # array of all weight tuples at once
+            weight_arr = np.array(dag_ls, dtype=float).reshape(-1, len(kwargls))
+            if ranking_coeffs:
+                order = np.argsort(weight_arr @ np.array(coeffs), kind="stable")
+            else:
+                # np.lexsort uses the last key as the primary sort key
+                order = np.lexsort(
+                    (weight_arr[:, 2], weight_arr[:, 1], -weight_arr[:, 0])
+                )
+            dag_ls = [dag_ls[i] for i in order]
 
             df = pd.DataFrame(dag_ls, columns=dagweight_kwargs.names)
+            df["count"] = [dag_weightcounts[weighttuple] for weighttuple in dag_ls]
             df.to_csv(outbase + ".tree_stats.csv")
             df["set"] = ["all_trees"] * len(df)
             bestdf = pd.DataFrame([best_weighttuple], columns=dagweight_kwargs.names)
+            bestdf["count"] = [1]
             bestdf["set"] = ["best_tree"]
             toplot_df = pd.concat([df, bestdf], ignore_index=True)
+            import seaborn as sns
+
             pplot = sns.pairplot(
                 toplot_df[["Log Likelihood", "Isotype Pars.", "Mut. Pars.", "set"]],
                 hue="set",
                 diag_kind="hist",
+                diag_kws={"weights": toplot_df["count"]},
             )
             pplot.savefig(outbase + ".tree_stats.pairplot.png")
 
@@ -1351,14 +1459,22 @@ class CollapsedForest:
     def likelihood_rankplot(self, outbase, p, q, img_type="svg"):
         """Save a rank plot of likelihoods to the file
         `[outbase].inference.likelihood_rank.[img_type]`."""
+        import matplotlib.pyplot as plt
+
         ll_dagfuncs = _ll_genotype_dagfuncs(p, q)
         if self._forest is not None:
-            dag_l = list(
-                float(ll) for ll in self._forest.weight_count(**ll_dagfuncs).elements()
+            dag_l = np.fromiter(
+                (
+                    float(ll)
+                    for ll in self._forest.weight_count(**ll_dagfuncs).elements()
+                ),
+                dtype=np.float64,
+                count=self.n_trees,
             )
         else:
-            dag_l = [ctree.ll(p, q)[0] for ctree in self]
-        dag_l.sort(key=lambda n: -n)
+            dag_l = np.array([ctree.ll(p, q)[0] for ctree in self], dtype=np.float64)
+        # descending order
+        dag_l = np.sort(dag_l)[::-1]
         plt.figure(figsize=(6.5, 2))
         try:
             plt.plot(np.exp(dag_l), "ko", clip_on=False, markersize=4)
@@ -1451,6 +1567,7 @@ class CollapsedForest:
         newforest.n_trees = dag.count_trees()
         newforest._forest = dag
         newforest.parameters = self.parameters
+        newforest._taxon_bit = self._taxon_bit
         return newforest
 
     def _clade_tree_to_ctree(
@@ -1490,17 +1607,45 @@ class CollapsedForest:
         )
 
         ctree = CollapsedTree(etetree)
+        ctree._taxon_bit = self._taxon_bit
+
+        self._validate(ctree, etetree)
+        return ctree
+
+    def _validate(self, ctree: CollapsedTree, etetree: ete3.TreeNode):
+        """Validate a :meth:`CollapsedTree` built from a tree-shaped history
+        DAG against self._validation_stats, visiting the nodes of the collapsed
+        tree once to collect their attributes.
+
+        Args:
+            ctree: The collapsed tree to validate
+            etetree: The uncollapsed tree from which ``ctree`` was built
+        """
+        stats = self._validation_stats
+        if stats is not None:
+            counts = stats["counts"]
+            for node in etetree.iter_leaves():
+                assert (
+                    sum(counts[og_id] for og_id in node.original_ids) == node.abundance
+                )
+                assert node.name in node.original_ids
+
+        # Flatten the tree once into per-node columns, in breadth-first order
+        # so that the root comes first, with each node's parent index
+        nodes = [ctree.tree]
+        parent_idx = [-1]
+        i = 0
+        while i < len(nodes):
+            for child in nodes[i].children:
+                nodes.append(child)
+                parent_idx.append(i)
+            i += 1
+        names = [node.name for node in nodes]
+        seqs = [node.sequence for node in nodes]
 
         # Fix internal node names to be unique, and verify
         # The maps from nodes to names and nodes to sequences are bijections
-        n_nodes = 0
-        names = set()
-        seqs = set()
-        for node in ctree.tree.traverse():
-            n_nodes += 1
-            names.add(node.name)
-            seqs.add(node.sequence)
-        n_names, n_seqs = len(names), len(seqs)
+        n_nodes, n_names, n_seqs = len(nodes), len(set(names)), len(set(seqs))
         if not (n_nodes == n_names and n_names == n_seqs):
             raise RuntimeError(
                 "Multiple sequences with the same name, or multiple"
@@ -1508,85 +1653,70 @@ class CollapsedForest:
             )
 
         # Here can do some validation on the tree:
-        if self._validation_stats is not None:
-            # root name:
-            if self._validation_stats["root"] != ctree.tree.name:
-                raise RuntimeError(
-                    f"collapsed tree should have root name '{self._validation_stats['root']}' but has instead {ctree.tree.name}"
-                )
-            # counts:
-            counts = self._validation_stats["counts"]
-            for node in etetree.iter_leaves():
+        if stats is None:
+            warnings.warn("No validation was performed on tree")
+            return
+        # root name:
+        if stats["root"] != ctree.tree.name:
+            raise RuntimeError(
+                f"collapsed tree should have root name '{stats['root']}' but has instead {ctree.tree.name}"
+            )
+        # unnamed_seq issue:
+        if "unnamed_seq" in names:
+            raise RuntimeError("Some node names are missing")
+        # counts:
+        abundances = np.fromiter(
+            (node.abundance for node in nodes), dtype=np.int64, count=n_nodes
+        )
+        for node, name in zip(nodes, names):
+            if name in counts:
                 assert (
                     sum(counts[og_id] for og_id in node.original_ids) == node.abundance
                 )
-                assert node.name in node.original_ids
-            tree_abundance = 0
-            for node in ctree.tree.traverse():
-                tree_abundance += node.abundance
-                if node.name in counts:
-                    assert (
-                        sum(counts[og_id] for og_id in node.original_ids)
-                        == node.abundance
+                assert name in node.original_ids
+            else:
+                assert node.abundance == 0
+        assert int(abundances.sum()) == sum(counts.values())
+
+        # Parsimony: all sequences have the same length, so compare
+        # concatenated parent and child sequences bytewise
+        parent_arr = np.frombuffer(
+            "".join(seqs[j] for j in parent_idx[1:]).encode("ascii"), dtype=np.uint8
+        )
+        child_arr = np.frombuffer("".join(seqs[1:]).encode("ascii"), dtype=np.uint8)
+        if stats["parsimony_score"] != int(np.count_nonzero(parent_arr != child_arr)):
+            raise RuntimeError(
+                "History DAG tree parsimony score does not match parsimony score provided"
+            )
+        # Root sequence is a possible disambiguation of root:
+        root_masks = gctree.utils.sequence_masks(ctree.tree.sequence)
+        expected_masks = gctree.utils.sequence_masks(stats["root_seq"])
+        if _is_ambiguous(ctree.tree.sequence) or np.any(root_masks & ~expected_masks):
+            raise RuntimeError(
+                "History DAG root node sequence does not match root sequence provided\n"
+                "found: " + ctree.tree.sequence + "\n"
+                "expected: " + stats["root_seq"]
+            )
+        # Leaf names:
+        if "leaf_seqs" in stats:
+            # Will be intentionally missing if observed sequences had
+            # ambiguities.
+            leaf_seqs = stats["leaf_seqs"]
+            # A dictionary of leaf sequences to leaf names
+            observed_idx = np.flatnonzero(abundances[1:] > 0) + 1
+            for j in observed_idx:
+                if leaf_seqs[seqs[j]] != names[j]:
+                    raise RuntimeError(
+                        "History DAG tree leaf names don't match sequences"
                     )
-                    assert node.name in node.original_ids
-                else:
-                    assert node.abundance == 0
-            assert tree_abundance == sum(counts.values())
-
-            # unnamed_seq issue:
-            for node in ctree.tree.traverse():
-                if node.name == "unnamed_seq":
-                    raise RuntimeError("Some node names are missing")
-
-            # Parsimony:
-            if self._validation_stats["parsimony_score"] != sum(
-                [
-                    gctree.utils.hamming_distance(node.up.sequence, node.sequence)
-                    for node in ctree.tree.iter_descendants()
-                ]
-            ):
+            observed_seqs = {seqs[j] for j in observed_idx}
+            nonroot_observed_seqs = observed_seqs - {ctree.tree.sequence}
+            nonroot_leaf_seqs = set(leaf_seqs.keys()) - {ctree.tree.sequence}
+            if nonroot_leaf_seqs != nonroot_observed_seqs:
                 raise RuntimeError(
-                    "History DAG tree parsimony score does not match parsimony score provided"
+                    "Observed nonroot sequences in history DAG tree don't match "
+                    "observed nonroot sequences passed in leaf_seqs."
                 )
-            # Root sequence is a possible disambiguation of root:
-            if any(
-                base not in gctree.utils.ambiguous_dna_values[ambig_base]
-                for base, ambig_base in zip(
-                    ctree.tree.sequence, self._validation_stats["root_seq"]
-                )
-            ):
-                raise RuntimeError(
-                    "History DAG root node sequence does not match root sequence provided\n"
-                    "found: " + ctree.tree.sequence + "\n"
-                    "expected: " + self._validation_stats["root_seq"]
-                )
-            # Leaf names:
-            if "leaf_seqs" in self._validation_stats:
-                # Will be intentionally missing if observed sequences had
-                # ambiguities.
-                leaf_seqs = self._validation_stats["leaf_seqs"]
-                # A dictionary of leaf sequences to leaf names
-                observed_set = {
-                    node for node in ctree.tree.iter_descendants() if node.abundance > 0
-                }
-                for node in observed_set:
-                    if not node.is_root() and leaf_seqs[node.sequence] != node.name:
-                        raise RuntimeError(
-                            "History DAG tree leaf names don't match sequences"
-                        )
-                observed_seqs = {node.sequence for node in observed_set}
-                nonroot_observed_seqs = observed_seqs - {ctree.tree.sequence}
-                nonroot_leaf_seqs = set(leaf_seqs.keys()) - {ctree.tree.sequence}
-                if nonroot_leaf_seqs != nonroot_observed_seqs:
-                    raise RuntimeError(
-                        "Observed nonroot sequences in history DAG tree don't match "
-                        "observed nonroot sequences passed in leaf_seqs."
-                    )
-        else:
-            warnings.warn("No validation was performed on tree")
-
-        return ctree
 
     def __repr__(self):
         r"""Return a string representation for printing."""
@@ -1601,11 +1731,39 @@ class CollapsedForest:
         else:
             yield from ()
 
+    def iter_ctrees(self, workers: int = 1):
+        r"""Iterate over the trees in the forest like ``iter(forest)``,
+        optionally converting and validating trees from the history DAG in
+        parallel.
+
+        Trees are yielded in the same order as by ``iter(forest)``.
+
+        Args:
+            workers: maximum number of worker processes. By default trees are converted serially.
+                Parallel conversion starts a process pool, so scripts using it must guard their
+                entry point with ``if __name__ == "__main__":`` on platforms that spawn processes.
+        """
+        if self._forest is None or workers <= 1 or self.n_trees == 1:
+            yield from self
+            return
+        # Workers only need the validation data, not the DAG
+        converter = CollapsedForest()
+        converter._validation_stats = self._validation_stats
+        converter._taxon_bit = self._taxon_bit
+        clade_trees = list(self._forest.get_trees())
+        with cf.ProcessPoolExecutor(workers) as executor:
+            yield from executor.map(
+                converter._clade_tree_to_ctree,
+                clade_trees,
+                chunksize=max(1, len(clade_trees) // (workers * 4)),
+            )
+
     def __getstate__(self):
         # Avoid pickling large cached abundance data.
         # hDAG also defines its own getstate.
         d = self.__dict__.copy()
         d["_cm_countlist"] = None
+        d["_cm_table"] = None
         return d
 
 
@@ -1618,7 +1776,8 @@ def _mle_helper(
 
     def f(x):
         """Negative log likelihood."""
-        return tuple(-y for y in ll(*x, **kwargs))
+        value, grad = ll(*x, **kwargs)
+        return -value, -grad
 
     grad_check = sco.check_grad(lambda x: f(x)[0], lambda x: f(x)[1], x_0)
     if grad_check > 1e-3:
@@ -1654,103 +1813,167 @@ def _lltree(cm_counts, p: np.float64, q: np.float64) -> Tuple[np.float64, np.nda
     Returns:
         Log likelihood :math:`\ell(p, q; T, A)` and its gradient :math:`\nabla\ell(p, q; T, A)`
     """
-    count_ls = [n for cm, n in cm_counts]
-    cm_list = [cm for cm, n in cm_counts]
-    # extract vector of function values and gradient components
-    logf_data = [CollapsedTree._ll_genotype(c, m, p, q) for c, m in cm_list]
-    logf = np.array([[x[0] * count_ls[i]] for i, x in enumerate(logf_data)]).sum()
-    grad_ll_genotype = np.array(
-        [x[1] * count_ls[i] for i, x in enumerate(logf_data)]
-    ).sum(axis=0)
-    return logf, grad_ll_genotype
+    cm_arr, count_arr = _cm_counts_as_arrays(cm_counts)
+    # fill vector of function values and matrix of gradient components
+    logf_arr = np.empty(len(cm_arr))
+    grad_arr = np.empty((len(cm_arr), 2))
+    for i, (c, m) in enumerate(cm_arr.tolist()):
+        logf_arr[i], grad_arr[i] = CollapsedTree._ll_genotype(c, m, p, q)
+    return logf_arr @ count_arr, count_arr @ grad_arr
+
+
+def _cm_counts_as_arrays(cm_counts) -> Tuple[np.ndarray, np.ndarray]:
+    r"""Unpack (c, m) counts into arrays.
+
+    Args:
+        cm_counts: an iterable containing tuples `((c, m), n)` with distinct `(c, m)`,
+            like the items of a :class:`collections.Counter`
+    Returns:
+        An integer array of shape `(K, 2)` with a `(c, m)` pair in each row, and a float
+        array of the corresponding `K` counts
+    """
+    cm_counts = tuple(cm_counts)
+    cm_arr = np.array([cm for cm, _ in cm_counts], dtype=np.int64).reshape(-1, 2)
+    count_arr = np.fromiter(
+        (n for _, n in cm_counts), dtype=np.float64, count=len(cm_counts)
+    )
+    return cm_arr, count_arr
 
 
 def _is_ambiguous(sequence):
-    return any(base not in gctree.utils.bases for base in sequence)
+    # unambiguous bases have exactly one bit set
+    masks = gctree.utils.sequence_masks(sequence)
+    return bool(np.any((masks == 0) | (masks & (masks - 1))))
 
 
-def _make_dag(trees, from_copy=True):
+def _add_pseudo_leaf(tree):
+    """Add a pseudo-leaf below the root of a tree, with the root's name,
+    sequence, and abundance.
+
+    This is done before disambiguation in case root is ambiguous, and gets
+    merged with another ambiguous leaf node after disambiguation.
+    """
+    newleaf = tree.add_child(name=tree.name, dist=0)
+    newleaf.add_feature("sequence", tree.sequence)
+    newleaf.add_feature("abundance", tree.abundance)
+    return tree
+
+
+def _disambiguate_leaves(tree, rootname):
+    """Disambiguate a tree's leaf sequences, merging leaves which become
+    identical, and transplant them to the tree, leaving its internal sequences
+    ambiguous.
+
+    A pseudo-leaf is first added below the root, as by
+    :meth:`_add_pseudo_leaf`. The tree is modified and returned, so that this
+    can be mapped over trees in worker processes.
+    """
+    _add_pseudo_leaf(tree)
+    for node in tree.iter_leaves():
+        node.add_feature("original_ids", {node.name})
+    disambig_tree = tree.copy()
+    node_map = {
+        d_node: o_node
+        for d_node, o_node in zip(disambig_tree.traverse(), tree.traverse())
+    }
+    disambiguate(disambig_tree)
+
+    # remove duplicate leaves, and adjust abundances
+    leaf_seqs = {}
+    to_delete = []
+    for leaf in disambig_tree.iter_leaves():
+        if leaf.sequence in leaf_seqs:
+            leaf_seqs[leaf.sequence].append(leaf)
+        else:
+            leaf_seqs[leaf.sequence] = [leaf]
+    for sequence, leaf_list in leaf_seqs.items():
+        if len(leaf_list) > 1:
+            # Always choose root pseudo-leaf to represent nodes, if
+            # possible
+            _leaf_list_names = {node.name: node for node in leaf_list}
+            if rootname in _leaf_list_names:
+                rep_node = _leaf_list_names.pop(rootname)
+            else:
+                rep_node = _leaf_list_names.pop(leaf_list[0].name)
+            to_delete = list(_leaf_list_names.values())
+            rep_node.abundance = sum(leaf.abundance for leaf in leaf_list)
+            rep_node.original_ids = {
+                seq_id for node in leaf_list for seq_id in node.original_ids
+            }
+            for node in to_delete:
+                # A deleted leaf may leave behind a childless parent
+                # with the same sequence, which is a duplicate too.
+                while True:
+                    parent = node.up
+                    node_map[node].delete(prevent_nondicotomic=False)
+                    node.delete(prevent_nondicotomic=False)
+                    if (
+                        parent.children
+                        or parent.sequence != sequence
+                        or parent is rep_node
+                    ):
+                        break
+                    node = parent
+    # transplant leaf sequences and abundances:
+    for node in disambig_tree.iter_leaves():
+        node_map[node].abundance = node.abundance
+        node_map[node].sequence = node.sequence
+        node_map[node].original_ids = node.original_ids
+    # remove some unifurcations
+    to_delete = []
+    for node in tree.iter_descendants():
+        if len(node.children) == 1:
+            # this excludes leaves
+            to_delete.append(node)
+    for node in to_delete:
+        node.delete(prevent_nondicotomic=False)
+    return tree
+
+
+def _make_dag(trees, from_copy=True, workers=1):
     """Build a history DAG from ambiguous or disambiguated trees, whose nodes
-    have abundance, name, and sequence attributes."""
+    have abundance, name, and sequence attributes.
+
+    If leaf sequences are ambiguous and ``workers`` is more than one,
+    trees are disambiguated in a pool of that many worker processes.
+    """
     # preprocess trees so they're acceptable inputs
     # Assume all trees have fixed root sequence and fixed leaf sequences
 
-    if from_copy:
-        trees = [tree.copy() for tree in trees]
-
     # disambiguate leaves: disambiguate each tree and transplant disambiguated
     # leaf sequences to tree with ambiguous internal sequences
-
-    # add pseudo-leaf below root in all trees:
-    # This is done first in case root is ambiguous, and gets merged with
-    # another ambiguous leaf node after disambiguation.
     rootname = trees[0].name  # all root nodes must have the same name
-    for tree in trees:
-        newleaf = tree.add_child(name=tree.name, dist=0)
-        newleaf.add_feature("sequence", tree.sequence)
-        newleaf.add_feature("abundance", tree.abundance)
-
-    if any(_is_ambiguous(leaf.sequence) for leaf in trees[0].iter_leaves()):
+    # The root becomes a pseudo-leaf, so its sequence counts as observed
+    ambiguous = _is_ambiguous(trees[0].sequence) or any(
+        _is_ambiguous(leaf.sequence) for leaf in trees[0].iter_leaves()
+    )
+    if ambiguous:
         warnings.warn(
             "Some observed sequences are ambiguous. A disambiguation consistent"
             " with each dnapars tree will be chosen arbitrarily. Many alternative"
             " disambiguated leaf sequences may be possible."
         )
-        for tree in trees:
-            for node in tree.iter_leaves():
-                node.add_feature("original_ids", {node.name})
-            disambig_tree = tree.copy()
-            node_map = {
-                d_node: o_node
-                for d_node, o_node in zip(disambig_tree.traverse(), tree.traverse())
-            }
-            disambiguate(disambig_tree)
-
-            # remove duplicate leaves, and adjust abundances
-            leaf_seqs = {}
-            to_delete = []
-            for leaf in disambig_tree.iter_leaves():
-                if leaf.sequence in leaf_seqs:
-                    leaf_seqs[leaf.sequence].append(leaf)
-                else:
-                    leaf_seqs[leaf.sequence] = [leaf]
-            for sequence, leaf_list in leaf_seqs.items():
-                if len(leaf_list) > 1:
-                    # Always choose root pseudo-leaf to represent nodes, if
-                    # possible
-                    ancestor = disambig_tree.get_common_ancestor(*leaf_list)
-                    _leaf_list_names = {node.name: node for node in leaf_list}
-                    if rootname in _leaf_list_names:
-                        rep_node = _leaf_list_names.pop(rootname)
-                    else:
-                        rep_node = _leaf_list_names.pop(leaf_list[0].name)
-                    to_delete = list(_leaf_list_names.values())
-                    rep_node.abundance = sum(leaf.abundance for leaf in leaf_list)
-                    rep_node.original_ids = {
-                        seq_id for node in leaf_list for seq_id in node.original_ids
-                    }
-                    while to_delete:
-                        for node in to_delete:
-                            node_map[node].delete(prevent_nondicotomic=False)
-                            node.delete(prevent_nondicotomic=False)
-                        to_delete = [
-                            leaf
-                            for leaf in ancestor.iter_leaves()
-                            if (leaf.sequence == sequence and leaf != rep_node)
-                        ]
-            # transplant leaf sequences and abundances:
-            for node in disambig_tree.iter_leaves():
-                node_map[node].abundance = node.abundance
-                node_map[node].sequence = node.sequence
-                node_map[node].original_ids = node.original_ids
-            # remove some unifurcations
-            to_delete = []
-            for node in tree.iter_descendants():
-                if len(node.children) == 1:
-                    # this excludes leaves
-                    to_delete.append(node)
-            for node in to_delete:
-                node.delete(prevent_nondicotomic=False)
+    if ambiguous and workers > 1 and len(trees) > 1:
+        # Worker processes receive their own copies of the trees, so there's
+        # no need to copy them here first.
+        workers = min(workers, len(trees))
+        with cf.ProcessPoolExecutor(workers) as executor:
+            trees = list(
+                executor.map(
+                    _disambiguate_leaves,
+                    trees,
+                    [rootname] * len(trees),
+                    chunksize=max(1, len(trees) // (workers * 4)),
+                )
+            )
+    else:
+        if from_copy:
+            trees = [tree.copy() for tree in trees]
+        if ambiguous:
+            trees = [_disambiguate_leaves(tree, rootname) for tree in trees]
+        else:
+            for tree in trees:
+                _add_pseudo_leaf(tree)
 
     def trees_to_dag(trees):
         return hdag.history_dag_from_etes(
@@ -1766,7 +1989,7 @@ def _make_dag(trees, from_copy=True):
                     if n.is_leaf()
                     else set()
                 ),
-                "isotype": frozendict(),
+                "isotype": _EMPTY_FROZENDICT,
             },
         )
 
@@ -1808,13 +2031,21 @@ def _make_dag(trees, from_copy=True):
     # Only leaf nodes have nonzero abundance now, so all internal edges are
     # collapsed by sequence. Now labels with correct abundances are placed on
     # leaf-adjacent nodes that will be collapsed by sequence.
+    # Sequences are also interned, since the same sequences recur on many
+    # nodes, and are compared and hashed by all the DAG weight functions.
     for node in dag.preorder(skip_root=True):
+        label = node.label._replace(sequence=sys.intern(node.label.sequence))
+        node.label = label
         if node.is_leaf():
+            sequence = label.sequence
             for parent in node.parents:
-                if parent.label.sequence == node.label.sequence:
-                    parent.label = node.label
+                if parent.label.sequence == sequence:
+                    parent.label = label
 
-    if len(dag.hamming_parsimony_count()) > 1:
+    # Only the min and max parsimony scores are needed to check that they're
+    # all the same, which is cheaper than counting trees with each score
+    min_parsimony, max_parsimony = dag.weight_range_annotate()
+    if min_parsimony != max_parsimony:
         raise RuntimeError(
             f"History DAG parsimony search resulted in parsimony trees of unexpected weights:\n {dag.hamming_parsimony_count()}"
         )
@@ -1824,6 +2055,23 @@ def _make_dag(trees, from_copy=True):
     return dag
 
 
+def _mutant_clade_count(node: hdag.HistoryDagNode) -> int:
+    """The number of child clades of a DAG node, not counting a clade
+    containing only the node's own label, which would be collapsed.
+
+    A node's clades determine its identity in the DAG, so the result is
+    cached on the node, since it is needed for every edge into the node.
+    """
+    try:
+        return node._mutant_clade_count
+    except AttributeError:
+        m = len(node.clades)
+        if frozenset({node.label}) in node.clades:
+            m -= 1
+        node._mutant_clade_count = m
+        return m
+
+
 def _cmcounter_dagfuncs():
     """Functions for accumulating frozen multisets of (c, m) pairs in trees in
     the DAG."""
@@ -1833,16 +2081,17 @@ def _cmcounter_dagfuncs():
             # Then this is a leaf-adjacent node with nonzero abundance
             return multiset.FrozenMultiset()
         else:
-            m = len(n2.clades)
-            if frozenset({n2.label}) in n2.clades:
-                m -= 1
+            m = _mutant_clade_count(n2)
             return multiset.FrozenMultiset([(n2.label.abundance, m)])
 
     def accum_func(cmsetlist: List[multiset.FrozenMultiset]):
-        st = multiset.FrozenMultiset()
+        # Weights must be hashable, but summing frozen multisets copies at
+        # every step, so accumulate into a Counter and freeze once.
+        st = coll.Counter()
         for cmset in cmsetlist:
-            st += cmset
-        return st
+            for cm, n in cmset.items():
+                st[cm] += n
+        return multiset.FrozenMultiset(st)
 
     return hdag.utils.AddFuncDict(
         {
@@ -1857,13 +2106,13 @@ def _cmcounter_dagfuncs():
 def _ll_genotype_dagfuncs(p: np.float64, q: np.float64) -> hdag.utils.AddFuncDict:
     """Return functions for counting tree log likelihood on the history DAG.
 
-    For numerical consistency, we resort to the use of ``decimal.Decimal``.
-    This is exactly for the purpose of solving the problem that float sum is
-    sensitive to order of summation, while Decimal sum is not.
+    For numerical consistency, sums are computed with Neumaier's compensated
+    summation. This is for the purpose of solving the problem that float sum is
+    sensitive to order of summation, while compensated sum is (practically) not.
 
-    Still, there seems to be some inconsistency (probably in the part of the computation done with floats)
-    so we wrap the Decimal in a :class:`historydag.utils.FloatState` object, where the exposed
-    float is a rounded version of the hidden Decimal state, which is used for actual computations.
+    The running sum and its compensation term are kept as the state of a
+    :class:`historydag.utils.FloatState` object, where the exposed float is a
+    rounded version of the compensated sum.
 
 
     Args:
@@ -1874,9 +2123,14 @@ def _ll_genotype_dagfuncs(p: np.float64, q: np.float64) -> hdag.utils.AddFuncDic
         to :meth:`historydag.HistoryDag.weight_count`, :meth:`historydag.HistoryDag.trim_optimal_weight`,
         or :meth:`historydag.HistoryDag.optimal_weight_annotate`
         methods to trim or annotate a :meth:`historydag.HistoryDag` according to branching process likelihood.
-        Weight format is ``decimal.Decimal``.
+        Weight format is :class:`historydag.utils.FloatState`.
     """
 
+    # Many edges share the same (c, m), so each weight is built once and
+    # shared, since FloatState weights are never modified.
+    zero_weight = hdag.utils.FloatState(0.0, state=(0.0, 0.0))
+    cm_weights = {}
+
     def edge_weight_ll_genotype(n1: hdag.HistoryDagNode, n2: hdag.HistoryDagNode):
         """The _ll_genotype weight of the target node, unless it should be
         collapsed, then 0.
@@ -1885,26 +2139,40 @@ def _ll_genotype_dagfuncs(p: np.float64, q: np.float64) -> hdag.utils.AddFuncDic
         abundance feature on label.
         """
         if n2.is_leaf() and n2.label.sequence == n1.label.sequence:
-            return hdag.utils.FloatState(0.0, state=Decimal(0.0))
+            return zero_weight
         else:
-            m = len(n2.clades)
-            # Check if this edge should be collapsed, and reduce mutant descendants
-            if frozenset({n2.label}) in n2.clades:
-                m -= 1
+            m = _mutant_clade_count(n2)
             c = n2.label.abundance
             if n1.is_root() and c == 0 and m == 1:
                 # Add pseudocount for unobserved root unifurcation
                 c = 1
-            res = Decimal(CollapsedTree._ll_genotype(c, m, p, q)[0])
-            return hdag.utils.FloatState(float(round(res, 8)), state=res)
+            try:
+                return cm_weights[c, m]
+            except KeyError:
+                res = float(CollapsedTree._ll_genotype(c, m, p, q)[0])
+                weight = hdag.utils.FloatState(round(res, 8), state=(res, 0.0))
+                cm_weights[c, m] = weight
+                return weight
 
     def accum_func(weightlist):
-        res = sum(weight.state for weight in weightlist)
-        return hdag.utils.FloatState(float(round(res, 8)), state=res)
+        # Neumaier summation of (sum, compensation) states
+        total, compensation = 0.0, 0.0
+        for weight in weightlist:
+            val, val_compensation = weight.state
+            new_total = total + val
+            if abs(total) >= abs(val):
+                compensation += (total - new_total) + val
+            else:
+                compensation += (val - new_total) + total
+            compensation += val_compensation
+            total = new_total
+        return hdag.utils.FloatState(
+            round(total + compensation, 8), state=(total, compensation)
+        )
 
     return hdag.utils.AddFuncDict(
         {
-            "start_func": lambda n: hdag.utils.FloatState(0.0, state=Decimal(0)),
+            "start_func": lambda n: zero_weight,
             "edge_weight_func": edge_weight_ll_genotype,
             "accum_func": accum_func,
         },
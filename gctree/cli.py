@@ -633,7 +633,8 @@ def get_parser():
         "--tree_stats",
         action="store_true",
         help=(
-            "write a file `[outbase].tree_stats.log` with stats for all trees in the forest. "
+            "write a file `[outbase].tree_stats.csv` with stats for all trees in the forest, "
+            "with a count of trees for each distinct combination of stats. "
             "For large forests, this is slow and memory intensive."
         ),
     )
@@ -1,11 +1,32 @@
 import pickle
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict
 from gctree.isotyping import (
     explode_idmap,
     isotype_tree,
-    isotype_parsimony,
     default_isotype_order,
+    IsotypeTemplate,
+    _read_isotypemap,
+    _read_idmap,
+    _summarize_isotyped,
+)
+
+_isotype_palette = (
+    "#a6cee3",
+    "#1f78b4",
+    "#b2df8a",
+    "#33a02c",
+    "#fb9a99",
+    "#e31a1c",
+    "#fdbf6f",
+    "#ff7f00",
+    "#cab2d6",
+    "#6a3d9a",
+    "#ffff99",
+    "#b15928",
 )
 
 
@@ -83,24 +104,60 @@ def get_parser() -> argparse.ArgumentParser:
         default=None,
         help="Directory in which to place output. Default is working directory.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to load and isotype trees. Default is to process trees serially.",
+    )
     return parser
 
 
+@dataclass
+class TreeStat:
+    """Summary of one isotyped tree, as reported by ``isotype``."""
+
+    name: str
+    ctree: Any
+    original_numnodes: int
+    new_numnodes: int
+    parsimony: float
+    colormap: Dict[str, str]
+
+
+def _load_and_isotype(treefile, newidmap, isotype_names, isotype_template):
+    """Load a pickled collapsed tree and add isotypes to it, returning the
+    tree and its node count before isotyping."""
+    with open(treefile, "rb") as fh:
+        ctree = pickle.load(fh)
+    original_numnodes = sum(1 for _ in ctree.tree.traverse())
+    ctree.tree = isotype_tree(
+        ctree.tree, newidmap, isotype_names, isotype_template=isotype_template
+    )
+    return ctree, original_numnodes
+
+
+# Isotyping arguments shared by all trees, sent once to each worker process
+_worker_isotyping_args = None
+
+
+def _init_isotyping_worker(newidmap, isotype_names, isotype_template):
+    global _worker_isotyping_args
+    _worker_isotyping_args = (newidmap, isotype_names, isotype_template)
+
+
+def _load_and_isotype_in_worker(treefile):
+    return _load_and_isotype(treefile, *_worker_isotyping_args)
+
+
+def _write_tree_files(ctree, outbase):
+    """Write newick and pickle files for an isotyped collapsed tree."""
+    ctree.newick(outbase + ".nk")
+    with open(outbase + ".p", "wb") as fh:
+        pickle.dump(ctree, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+
 def main(arg_list=None):
-    isotype_palette = [
-        "#a6cee3",
-        "#1f78b4",
-        "#b2df8a",
-        "#33a02c",
-        "#fb9a99",
-        "#e31a1c",
-        "#fdbf6f",
-        "#ff7f00",
-        "#cab2d6",
-        "#6a3d9a",
-        "#ffff99",
-        "#b15928",
-    ]
     args = get_parser().parse_args(arg_list)
     if args.out_directory:
         out_directory = args.out_directory + "/"
@@ -109,74 +166,71 @@ def main(arg_list=None):
             p.mkdir()
     else:
         out_directory = ""
-    with open(args.isotype_mapfile, "r") as fh:
-        isotypemap = dict(map(lambda x: x.strip(), line.split(",")) for line in fh)
-
-    with open(args.idmapfile, "r") as fh:
-        idmap = {}
-        for line in fh:
-            seqid, cell_ids = line.rstrip().split(",")
-            cell_idset = {cell_id for cell_id in cell_ids.split(":") if cell_id}
-            if len(cell_idset) > 0:
-                idmap[seqid] = cell_idset
-
-    ctrees = []
-    for treefile in args.trees:
-        with open(treefile, "rb") as fh:
-            ctrees.append(pickle.load(fh))
-    # parse the idmap file and the isotypemap file
-    tree_stats = [
-        [
-            filename,
-            Path(filename).name,
-            ctree,
-            sum(1 for _ in ctree.tree.traverse()),
-        ]
-        for filename, ctree in zip(args.trees, ctrees)
-    ]
+    isotypemap = _read_isotypemap(args.isotype_mapfile)
+    idmap = _read_idmap(args.idmapfile)
+
     if not args.isotype_names:
         isotype_names = default_isotype_order
     else:
         isotype_names = args.isotype_names
 
     newidmap = explode_idmap(idmap, isotypemap)
-    for ctree in ctrees:
-        ctree.tree = isotype_tree(ctree.tree, newidmap, isotype_names)
-
-    flattened_newidmap = {
-        name + " " + str(isotype): cell_idset
-        for name, cellid_map in newidmap.items()
-        for isotype, cell_idset in cellid_map.items()
-    }
-
+    # the same isotype order and weights are used for every tree
+    isotype_template = IsotypeTemplate(isotype_names)
+    # Trees are loaded and isotyped independently, so this may be done in
+    # parallel, keeping the order of the provided files.
+    workers = min(args.workers, len(args.trees))
+    if workers > 1:
+        with ProcessPoolExecutor(
+            workers,
+            initializer=_init_isotyping_worker,
+            initargs=(newidmap, isotype_names, isotype_template),
+        ) as executor:
+            results = list(executor.map(_load_and_isotype_in_worker, args.trees))
+    else:
+        results = [
+            _load_and_isotype(treefile, newidmap, isotype_names, isotype_template)
+            for treefile in args.trees
+        ]
     with open(out_directory + "isotyped.idmap", "w") as fh:
-        for name, cellidset in flattened_newidmap.items():
-            print(f"{name},{':'.join(cellidset)}", file=fh)
+        for name, cellid_map in newidmap.items():
+            for isotype, cell_idset in cellid_map.items():
+                fh.write(f"{name} {isotype},{':'.join(cell_idset)}\n")
 
-    for sublist in tree_stats:
-        sublist.append(isotype_parsimony(sublist[2].tree))
+    # color for each isotype index, cycling through the palette
+    isotype_colors = tuple(
+        _isotype_palette[idx % len(_isotype_palette)]
+        for idx in range(len(isotype_names))
+    )
+    tree_stats = [
+        TreeStat(
+            Path(filename).name,
+            ctree,
+            original_numnodes,
+            *_summarize_isotyped(ctree.tree, isotype_colors),
+        )
+        for filename, (ctree, original_numnodes) in zip(args.trees, results)
+    ]
 
     print("name\t\t\t original node count\t isotype parsimony\t new node count")
-    for (
-        filename,
-        name,
-        ctree,
-        original_numnodes,
-        parsimony,
-    ) in tree_stats:
-        print(
-            f"{name}\t\t {original_numnodes}\t\t\t {parsimony}\t\t\t {sum(1 for _ in ctree.tree.traverse())}"
-        )
-        colormap = {
-            node.name: isotype_palette[node.isotype.isotype % len(isotype_palette)]
-            for node in ctree.tree.traverse()
-        }
-        newfilename = name + f".isotype_parsimony.{int(parsimony)}"
-        ctree.render(
-            outfile=out_directory + newfilename + ".svg",
-            colormap=colormap,
-            idlabel=True,
-        )
-        ctree.newick(out_directory + newfilename + ".nk")
-        with open(out_directory + newfilename + ".p", "wb") as fh:
-            fh.write(pickle.dumps(ctree))
+    # Rendering must stay on the main thread for Qt, but the newick and pickle
+    # writes can overlap with rendering the next tree.
+    with ThreadPoolExecutor(max_workers=min(8, len(tree_stats) or 1)) as executor:
+        writes = []
+        for ts in tree_stats:
+            print(
+                f"{ts.name}\t\t {ts.original_numnodes}\t\t\t {ts.parsimony}\t\t\t {ts.new_numnodes}"
+            )
+            newfilename = ts.name + f".isotype_parsimony.{int(ts.parsimony)}"
+            writes.append(
+                executor.submit(
+                    _write_tree_files, ts.ctree, out_directory + newfilename
+                )
+            )
+            ts.ctree.render(
+                outfile=out_directory + newfilename + ".svg",
+                colormap=ts.colormap,
+                idlabel=True,
+            )
+        for future in writes:
+            future.result()
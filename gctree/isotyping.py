@@ -3,10 +3,12 @@ r"""A module for incorporating isotype information in gctree inference."""
 from gctree.utils import hamming_distance
 
 import random
+import numpy as np
 import ete3
 import warnings
-from typing import Dict, Callable, Optional, Set, Sequence, Mapping, Tuple
+from typing import Dict, Callable, Optional, Set, Sequence, Mapping, Tuple, Iterator
 from functools import wraps
+from collections import defaultdict
 import historydag as hdag
 from frozendict import frozendict
 
@@ -159,7 +161,20 @@ class Isotype:
             return self.isotype > other.isotype
 
     def __hash__(self) -> int:
-        return hash(self.__repr__())
+        # Isotypes are hashed often as weight dictionary keys in the history
+        # DAG, and never modified, so the hash is computed only once.
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(self.__repr__())
+            return self._hash
+
+    def __getstate__(self):
+        # String hashes differ between processes, so the cached hash must not
+        # be pickled.
+        state = self.__dict__.copy()
+        state.pop("_hash", None)
+        return state
 
     def resolutions(self) -> Sequence["Isotype"]:
         """Returns list of all possible isotypes if passed an ambiguous
@@ -181,6 +196,7 @@ def isotype_tree(
     newidmap: Dict[str, Dict[str, str]],
     isotype_names: Sequence[str],
     weight_matrix: Optional[Sequence[Sequence[float]]] = None,
+    isotype_template: Optional[IsotypeTemplate] = None,
 ) -> ete3.TreeNode:
     """Method adds isotypes to ``tree``, minimizing isotype switching and
     obeying switching order.
@@ -207,13 +223,22 @@ def isotype_tree(
         tree: ete3 Tree
         newidmap: mapping of sequence IDs to isotypes, such as that output by :meth:`utils.explode_idmap`.
         isotype_names: list or other sequence of isotype names observed, in correct switching order.
+        weight_matrix: An optional matrix containing transition weights between isotypes, as accepted by :meth:`IsotypeTemplate`.
+        isotype_template: An optional :meth:`IsotypeTemplate` to use instead of building one from ``isotype_names``
+            and ``weight_matrix``. Passing one avoids rebuilding it when isotyping many trees.
 
     Returns:
         A new ete3 Tree whose nodes have isotype annotations in the attribute ``isotype``.
         Node names in this tree also contain isotype names.
     """
     tree = tree.copy()
-    _add_observed_isotypes(tree, newidmap, isotype_names, weight_matrix=weight_matrix)
+    _add_observed_isotypes(
+        tree,
+        newidmap,
+        isotype_names,
+        weight_matrix=weight_matrix,
+        isotype_template=isotype_template,
+    )
     _disambiguate_isotype(tree)
     _collapse_tree_by_sequence_and_isotype(tree)
     for node in tree.traverse():
@@ -245,60 +270,75 @@ def isotype_parsimony(tree: ete3.TreeNode) -> float:
     the return value of this function is the number of isotype
     transitions along edges in the tree.
     """
-    return sum(
-        isotype_distance(node.up.isotype, node.isotype)
-        for node in tree.iter_descendants()
-    )
+    return _summarize_isotyped(tree)[1]
+
+
+def _summarize_isotyped(
+    tree: ete3.TreeNode, isotype_colors: Optional[Sequence[str]] = None
+) -> Tuple[int, float, Optional[Dict[str, str]]]:
+    """Count the nodes of an isotyped tree, compute its isotype parsimony
+    score, and if ``isotype_colors`` (a color for each isotype index) is
+    provided, build a colormap of node names, all in a single traversal.
+
+    Returns:
+        A tuple containing the node count, the isotype parsimony score, and the colormap,
+        or None if no colors were provided.
+    """
+    numnodes = 0
+    parsimony = 0
+    colormap = None if isotype_colors is None else {}
+    for node in tree.traverse():
+        numnodes += 1
+        if colormap is not None:
+            colormap[node.name] = isotype_colors[node.isotype.isotype]
+        if node.up is not None:
+            parsimony += isotype_distance(node.up.isotype, node.isotype)
+    return numnodes, parsimony, colormap
 
 
 def _disambiguate_isotype(
     tree: ete3.Tree, random_state=None, dist_func=isotype_distance
 ):
-    def is_ambiguous(isotype):
-        return isotype.isotype is None
-
     if random_state is None:
         random.seed(tree.write(format=1))
     else:
         random.setstate(random_state)
 
-    # First pass of Sankoff: compute cost vectors
+    # All isotypes in the tree share the same order and weights, so work with
+    # isotype indices and a precomputed transition cost matrix.
+    root_isotype = tree.isotype
+    order, weight_matrix = root_isotype.order, root_isotype.weight_matrix
+    all_isotypes = [Isotype(order, weight_matrix, name) for name in order]
+    dist = np.array(
+        [[dist_func(t1, t2) for t2 in all_isotypes] for t1 in all_isotypes],
+        dtype=float,
+    )
+    all_states = np.arange(len(order))
+
+    # First pass of Sankoff: compute cost vectors, indexed like `states`
+    states = {}
+    costs = {}
     for node2 in tree.traverse(strategy="postorder"):
-        node2.add_feature("costs", [[seq, 0] for seq in node2.isotype.resolutions()])
-        if not node2.is_leaf():
-            for seq_cost in node2.costs:
-                for child in node2.children:
-                    seq_cost[1] += min(
-                        [
-                            dist_func(seq_cost[0], child_seq) + child_cost
-                            for child_seq, child_cost in child.costs
-                        ]
-                    )
+        idx = node2.isotype.isotype
+        node_states = all_states if idx is None else all_states[idx : idx + 1]
+        node_costs = np.zeros(len(node_states))
+        for child in node2.children:
+            child_costs = dist[np.ix_(node_states, states[child])] + costs[child]
+            node_costs += child_costs.min(axis=1)
+        states[node2] = node_states
+        costs[node2] = node_costs
     # Second pass: Choose base and adjust children's cost vectors.
     # Not necessary if we only want the minimum weight:
     for node2 in tree.traverse(strategy="preorder"):
-        if not is_ambiguous(node2.isotype):
+        if node2.isotype.isotype is not None:
             continue
-        min_cost = min([cost for _, cost in node2.costs])
-        resolved_isotype = random.choice(
-            [isotype for isotype, cost in node2.costs if cost == min_cost]
-        )
+        node_costs = costs[node2]
+        min_states = states[node2][node_costs == node_costs.min()]
+        resolved = random.choice(min_states.tolist())
         # Adjust child cost vectors
-        if not node2.is_leaf():
-            for child in node2.children:
-                child.costs = [
-                    [
-                        isotype,
-                        cost + dist_func(resolved_isotype, isotype),
-                    ]
-                    for isotype, cost in child.costs
-                ]
-        node2.isotype = resolved_isotype
-    for node in tree.traverse():
-        try:
-            node.del_feature("costs")
-        except (AttributeError, KeyError):
-            pass
+        for child in node2.children:
+            costs[child] = costs[child] + dist[resolved, states[child]]
+        node2.isotype = Isotype(order, weight_matrix, order[resolved])
 
 
 def _add_observed_isotypes(
@@ -306,10 +346,13 @@ def _add_observed_isotypes(
     newidmap: Dict[str, str],
     isotype_order: Sequence[str],
     weight_matrix: Optional[Sequence[Sequence[float]]] = None,
+    isotype_template: Optional[IsotypeTemplate] = None,
 ):
+    if isotype_template is None:
+        isotype_template = IsotypeTemplate(isotype_order, weight_matrix=weight_matrix)
+    newisotype = isotype_template.new
     # Drop observed nodes as leaves and explode by observed isotype:
     # Descend internal observed nodes as leaves:
-    newisotype = IsotypeTemplate(isotype_order, weight_matrix=weight_matrix).new
     for node in list(tree.iter_descendants()):
         if node.abundance > 0 and not node.is_leaf():
             newchild = ete3.TreeNode(name=node.name)
@@ -358,6 +401,46 @@ def _add_observed_isotypes(
             node.add_feature("isotype", newisotype("?"))
 
 
+def _read_map_lines(filename: str, strip_line: bool) -> Iterator[Tuple[str, str]]:
+    """Yield the two comma-separated fields of each line of a headerless map
+    file, raising a ValueError for any line without exactly two fields."""
+    with open(filename, "r") as fh:
+        for lineno, line in enumerate(fh, start=1):
+            fields = (line.rstrip() if strip_line else line).split(",")
+            if len(fields) != 2:
+                raise ValueError(
+                    f"Expected two comma-separated fields on line {lineno} of "
+                    f"{filename}, found {len(fields)}"
+                )
+            yield fields[0], fields[1]
+
+
+def _read_isotypemap(isotypemap_file: str) -> Dict[str, str]:
+    """Read a csv file mapping original sequence IDs to observed isotype
+    names, with one ``original_id, isotype`` pair per line."""
+    return {
+        original_id.strip(): isotype.strip()
+        for original_id, isotype in _read_map_lines(isotypemap_file, False)
+    }
+
+
+def _read_idmap(idmap_file: str) -> Dict[str, Set[str]]:
+    """Read a csv file mapping unique sequence IDs to colon-separated original
+    sequence IDs, like the one output by deduplicate.
+
+    Sequence IDs with no original IDs are omitted.
+    """
+    idmap = {}
+    for seqid, cell_ids in _read_map_lines(idmap_file, True):
+        if not cell_ids:
+            continue
+        cell_idset = set(cell_ids.split(":"))
+        cell_idset.discard("")
+        if cell_idset:
+            idmap[seqid] = cell_idset
+    return idmap
+
+
 def _collapse_tree_by_sequence_and_isotype(tree: ete3.TreeNode):
     for node in tree.iter_descendants():
         node.dist = node.up.sequence != node.sequence or node.up.isotype != node.isotype
@@ -384,10 +467,10 @@ def explode_idmap(
     """
     newidmap = {}
     for id, cell_ids in idmap.items():
-        isotypeset = set()
+        isotype_cells = defaultdict(set)
         for cell_id in cell_ids:
             try:
-                isotypeset.add(isotype_map[cell_id])
+                isotype = isotype_map[cell_id]
             except KeyError:
                 warnings.warn(
                     f"Sequence ID {id} has original sequence id {cell_id} "
@@ -395,13 +478,9 @@ def explode_idmap(
                     "Isotype will be assumed ambiguous if observed."
                 )
                 isotype_map[cell_id] = "?"
-                isotypeset.add("?")
-        newidmap[id] = {
-            isotype: {
-                cell_id for cell_id in cell_ids if isotype_map[cell_id] == isotype
-            }
-            for isotype in isotypeset
-        }
+                isotype = "?"
+            isotype_cells[isotype].add(cell_id)
+        newidmap[id] = dict(isotype_cells)
     return newidmap
 
 
@@ -473,8 +552,7 @@ def _isotype_annotation_dagfuncs(
     if isotype_names is None:
         isotype_names = default_isotype_order
     if isotypemap_file and isotypemap is None:
-        with open(isotypemap_file, "r") as fh:
-            isotypemap = dict(map(lambda x: x.strip(), line.split(",")) for line in fh)
+        isotypemap = _read_isotypemap(isotypemap_file)
     elif isotypemap_file is None:
         raise ValueError("Either isotypemap or isotypemap_file is required")
 
@@ -482,13 +560,7 @@ def _isotype_annotation_dagfuncs(
         if idmap_file is None:
             raise TypeError("either idmap or idmap_file is required for isotyping")
         else:
-            with open(idmap_file, "r") as fh:
-                idmap = {}
-                for line in fh:
-                    seqid, cell_ids = line.rstrip().split(",")
-                    cell_idset = {cell_id for cell_id in cell_ids.split(":") if cell_id}
-                    if len(cell_idset) > 0:
-                        idmap[seqid] = cell_idset
+            idmap = _read_idmap(idmap_file)
     newidmap = explode_idmap(idmap, isotypemap)
     newisotype = IsotypeTemplate(isotype_names, weight_matrix=None).new
 
@@ -13,8 +13,12 @@ Typical usage is,
 $ mkconfig sequence.phy > dnapars.cfg $ dnapars < dnapars.cfg
 """
 import os
+import sys
 import argparse
 
+# PHYLIP random number seed (must be odd), fixed so runs are reproducible
+_SEED = "1"
+
 
 def get_parser():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -40,41 +44,36 @@ def get_parser():
 
 def main(arg_list=None):
     args = get_parser().parse_args(arg_list)
-    print(os.path.realpath(args.phylip))  # phylip input file
+    # collect responses and write them in one go
+    lines = [os.path.realpath(args.phylip)]  # phylip input file
     if args.treeprog == "seqboot":
-        print("R")
-        print(args.bootstrap)
-        print("Y")
-        # random seed for bootstrap (odd integer)
-        print("1")
+        lines += ["R", str(args.bootstrap), "Y"]
+        # random seed for bootstrap
+        lines.append(_SEED)
+        sys.stdout.write("\n".join(lines) + "\n")
         return
-    print("J")
+    lines.append("J")
     # random seed for tree search
-    print("1")
-    print(args.jumble)
+    lines.append(_SEED)
+    lines.append(str(args.jumble))
     if args.bootstrap:
-        print("M")
-        print("D")
-        print(args.bootstrap)
+        lines += ["M", "D", str(args.bootstrap)]
     if args.treeprog == "dnapars":
-        print("O")  # Outgroup root
-        print(1)  # arbitrary root on first
+        lines.append("O")  # Outgroup root
+        lines.append("1")  # arbitrary root on first
         if args.quick:
-            print("S")
-            print("Y")
-        print("4")
-        print("5")
-        print(".")
-        print("Y")
+            lines += ["S", "Y"]
+        lines += ["4", "5", ".", "Y"]
     elif args.treeprog == "dnaml":
-        print("O")  # Outgroup root
-        print(1)  # arbitrary root on first
-        print("R")  # gamma
-        print("5")  # Reconstruct hypothetical seq
-        print("Y")  # accept these
-        print("1.41421356237")  # CV = sqrt(2) (alpha = .5)
-        print("4")  # 4 catagories
+        lines.append("O")  # Outgroup root
+        lines.append("1")  # arbitrary root on first
+        lines.append("R")  # gamma
+        lines.append("5")  # Reconstruct hypothetical seq
+        lines.append("Y")  # accept these
+        lines.append("1.41421356237")  # CV = sqrt(2) (alpha = .5)
+        lines.append("4")  # 4 catagories
     else:
         raise RuntimeError(
             "treeprog=" + args.treeprog + ' is not "dnaml", "dnapars", or "seqboot"'
         )
+    sys.stdout.write("\n".join(lines) + "\n")
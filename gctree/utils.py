@@ -2,6 +2,7 @@ r"""Utility functions."""
 from functools import wraps, reduce
 import Bio.Data.IUPACData
 import operator
+import numpy as np
 from typing import Sequence, Any
 
 Multiplicable = Any
@@ -10,6 +11,12 @@ bases = "AGCT-"
 ambiguous_dna_values = Bio.Data.IUPACData.ambiguous_dna_values.copy()
 ambiguous_dna_values.update({"?": "GATC-", "-": "-"})
 ambiguous_dna_keys = {frozenset(val): key for key, val in ambiguous_dna_values.items()}
+# lookup table from ASCII code to a bitmask of the bases each character may
+# stand for, with one bit per character of ``bases`` (0 for unknown characters)
+base_to_mask = np.zeros(256, dtype=np.uint8)
+for _code, _values in ambiguous_dna_values.items():
+    base_to_mask[ord(_code)] = sum(1 << bases.index(base) for base in set(_values))
+del _code, _values
 
 
 def _check_distance_arguments(distance):
@@ -24,6 +31,15 @@ def _check_distance_arguments(distance):
     return new_distance
 
 
+def sequence_masks(sequence: str) -> np.ndarray:
+    r"""Array of ``base_to_mask`` bitmasks for each character of a sequence.
+
+    Args:
+        sequence: nucleotide sequence, possibly containing IUPAC ambiguity codes
+    """
+    return base_to_mask[np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)]
+
+
 @_check_distance_arguments
 def hamming_distance(seq1: str, seq2: str) -> int:
     r"""Hamming distance between two sequences of equal length.
@@ -0,0 +1,233 @@
+import gctree.branching_processes as bp
+import gctree.phylip_parse as pp
+import gctree.utils as utils
+from gctree.isotyping import _isotype_dagfuncs
+from gctree.mutation_model import _mutability_dagfuncs
+
+import copy
+import itertools
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+trees1 = pp.parse_outfile(
+    "tests/example_output/original/small_outfile",
+    abundance_file="tests/example_output/original/abundances.csv",
+    root="GL",
+)
+
+
+def write_mutation_model(outbase):
+    """Write a simple 5-mer mutability and substitution model, returning the
+    two file names"""
+    mutability_file = outbase + ".mutability.csv"
+    substitution_file = outbase + ".substitution.csv"
+    with open(mutability_file, "w") as mfh, open(substitution_file, "w") as sfh:
+        mfh.write("Fivemer,Mutability\n")
+        sfh.write("Fivemer,A,C,G,T\n")
+        for idx, fivemer in enumerate(itertools.product("ACGTN", repeat=5)):
+            fivemer = "".join(fivemer)
+            mfh.write(f"{fivemer},{1 + (idx % 7) / 7}\n")
+            subs = [0.0 if base == fivemer[2] else 1.0 for base in "ACGT"]
+            subs = [s / sum(subs) for s in subs]
+            sfh.write(fivemer + "," + ",".join(str(s) for s in subs) + "\n")
+    return mutability_file, substitution_file
+
+
+def rounded(weighttuple):
+    return tuple(round(float(w), 6) for w in weighttuple)
+
+
+@pytest.mark.parametrize("ranking_coeffs", [None, (1, 0.1, 0.5)])
+def test_tree_stats(tmp_path, ranking_coeffs):
+    """Rows of tree_stats.csv expanded by their count give one row per tree"""
+    outbase = str(tmp_path / "test")
+    mutability_file, substitution_file = write_mutation_model(outbase)
+    forest = bp.CollapsedForest(trees1)
+    forest.add_isotypes(
+        isotypemap_file="example/isotypemap.txt",
+        idmap_file="tests/example_output/original/idmap.txt",
+    )
+    forest.filter_trees(
+        ranking_coeffs=ranking_coeffs,
+        mutability_file=mutability_file,
+        substitution_file=substitution_file,
+        outbase=outbase,
+        tree_stats=True,
+    )
+
+    df = pd.read_csv(outbase + ".tree_stats.csv", index_col=0)
+    names = ["Log Likelihood", "Isotype Pars.", "Mut. Pars.", "Alleles"]
+    assert list(df.columns) == names + ["count"]
+    assert df["count"].sum() == forest.n_trees
+    expanded = Counter()
+    for row in df.itertuples(index=False):
+        expanded[rounded(row[:-1])] += row[-1]
+
+    kwargs = (
+        bp._ll_genotype_dagfuncs(*forest.parameters)
+        + _isotype_dagfuncs()
+        + _mutability_dagfuncs(
+            mutability_file=mutability_file, substitution_file=substitution_file
+        )
+        + bp._allele_dagfuncs()
+    )
+    pertree = Counter(
+        rounded(tree.optimal_weight_annotate(**kwargs))
+        for tree in forest._forest.get_trees()
+    )
+    assert expanded == pertree
+
+    # rows are ordered best first
+    if ranking_coeffs is None:
+        assert df["Log Likelihood"].is_monotonic_decreasing
+    else:
+        coeffs = [-1] + list(ranking_coeffs)
+        assert (df[names] @ coeffs).is_monotonic_increasing
+    assert (tmp_path / "test.tree_stats.pairplot.png").exists()
+
+
+def reference_splits(ctree):
+    """Splits of each non-root node as unordered pairs of sets of taxon
+    names"""
+    alltaxa = frozenset(ctree._taxa())
+    splits = {}
+    for node in ctree.tree.iter_descendants():
+        below = frozenset(
+            name
+            for node2 in node.traverse()
+            if node2.abundance > 0
+            for name in ((node2.name,) if isinstance(node2.name, str) else node2.name)
+        )
+        splits[node] = frozenset([below, alltaxa - below])
+    return splits
+
+
+def reference_support(ctree, bootstrap_trees, weights, compatibility):
+    """Support of each non-root node, computed with sets of taxon names"""
+    boot_splits_list = [
+        set(reference_splits(tree).values()) for tree in bootstrap_trees
+    ]
+    supports = {}
+    for node, split in reference_splits(ctree).items():
+        support = 0
+        for weight, boot_splits in zip(weights, boot_splits_list):
+            if compatibility:
+                counted = all(
+                    any(
+                        part1.isdisjoint(part2)
+                        for part1 in split
+                        for part2 in boot_split
+                    )
+                    for boot_split in boot_splits
+                )
+            else:
+                counted = split in boot_splits
+            if counted:
+                support += weight
+        supports[node] = support
+    return supports
+
+
+support_ctrees = list(itertools.islice(bp.CollapsedForest(trees1), 12))
+
+
+@pytest.mark.parametrize("compatibility", [False, True])
+@pytest.mark.parametrize("shared_taxon_bit", [True, False])
+def test_support(compatibility, shared_taxon_bit):
+    ctree = copy.deepcopy(support_ctrees[0])
+    bootstrap_trees = support_ctrees[1:]
+    assert ctree._taxon_bit is not None
+    if not shared_taxon_bit:
+        ctree._taxon_bit = None
+    weights = [1 / (i + 1) for i in range(len(bootstrap_trees))]
+    expected = reference_support(ctree, bootstrap_trees, weights, compatibility)
+    ctree.support(bootstrap_trees, weights=weights, compatibility=compatibility)
+    for node in ctree.tree.iter_descendants():
+        assert node.support == pytest.approx(expected[node])
+    # unweighted support counts trees
+    expected = reference_support(
+        ctree, bootstrap_trees, [1] * len(bootstrap_trees), compatibility
+    )
+    ctree.support(bootstrap_trees, compatibility=compatibility)
+    for node in ctree.tree.iter_descendants():
+        assert node.support == expected[node]
+
+
+def test_support_unknown_taxa():
+    """Bootstrap trees may have taxa missing from the forest's taxon bit map.
+    Exact support falls back to a new map, and compatibility is an error
+    because the splits cover different taxa"""
+    ctree = copy.deepcopy(support_ctrees[0])
+    renamed = copy.deepcopy(support_ctrees[1])
+    leaf = next(
+        node
+        for node in renamed.tree.iter_leaves()
+        if node.abundance > 0 and isinstance(node.name, str)
+    )
+    leaf.name = "unknown_taxon"
+    assert "unknown_taxon" not in ctree._taxon_bit
+    bootstrap_trees = [renamed] + support_ctrees[2:]
+    expected = reference_support(
+        ctree, bootstrap_trees, [1] * len(bootstrap_trees), False
+    )
+    ctree.support(bootstrap_trees)
+    for node in ctree.tree.iter_descendants():
+        assert node.support == expected[node]
+
+    with pytest.raises(ValueError, match="splits do not cover the same taxa") as e:
+        ctree.support(bootstrap_trees, compatibility=True)
+    assert "unknown_taxon" in str(e.value)
+
+
+def ctree_newick(ctree):
+    return ctree.tree.write(format=1, features=["sequence", "abundance"])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_iter_ctrees(workers):
+    forest = bp.CollapsedForest(trees1)
+    assert forest.n_trees > 1 and forest._taxon_bit is not None
+    expected = [ctree_newick(ctree) for ctree in forest]
+    ctrees = list(forest.iter_ctrees(workers=workers))
+    assert [ctree_newick(ctree) for ctree in ctrees] == expected
+    assert all(ctree._taxon_bit == forest._taxon_bit for ctree in ctrees)
+
+
+def ambiguous_trees():
+    """Example trees with a few leaf sequences made ambiguous at two sites,
+    consistently across trees"""
+    trees = pp.parse_outfile("tests/small_outfile", "tests/abundances.csv", "GL")
+    for tree in trees:
+        leaves = sorted(
+            (leaf for leaf in tree.iter_leaves() if leaf.name != "GL"),
+            key=lambda n: n.name,
+        )
+        for leaf in leaves[:3]:
+            leaf.sequence = "N" + leaf.sequence[1:4] + "R" + leaf.sequence[5:]
+    return trees
+
+
+def test_ambiguous_leaves():
+    trees = ambiguous_trees()
+    ambiguous_seqs = {leaf.name: leaf.sequence for leaf in trees[0].iter_leaves()}
+    forests = [
+        bp.CollapsedForest(ambiguous_trees(), workers=workers) for workers in (1, 2)
+    ]
+    # number of trees found before parallel disambiguation was added
+    assert [forest.n_trees for forest in forests] == [61, 61]
+    newicks = [sorted(ctree_newick(ctree) for ctree in forest) for forest in forests]
+    assert newicks[0] == newicks[1]
+
+    for ctree in forests[0]:
+        for node in ctree.tree.traverse():
+            if node.abundance == 0:
+                continue
+            assert not bp._is_ambiguous(node.sequence)
+            names = (node.name,) if isinstance(node.name, str) else node.name
+            for name in names:
+                assert all(
+                    base in utils.ambiguous_dna_values[ambig_base]
+                    for base, ambig_base in zip(node.sequence, ambiguous_seqs[name])
+                )
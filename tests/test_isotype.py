@@ -3,6 +3,11 @@ import gctree.branching_processes as bp
 import gctree.isotyping as iso
 import gctree.phylip_parse as pp
 import ete3
+import os
+import pytest
+import pickle
+import subprocess
+import sys
 
 testtrees = [
     ("((((A2)?,(G2,G2)?)?,G2,(A2,A2)?)?)M;", 3.0),
@@ -57,3 +62,73 @@ def test_trim_byisotype():
     count = c[key]
     tdag.trim_optimal_weight(**kwargs, optimal_func=min)
     assert tdag.weight_count(**kwargs) == {key: count}
+
+
+def test_isotype_pickle_hash():
+    """An Isotype pickled in a process with a different string hash seed
+    must hash like an equal Isotype made in this one"""
+    script = (
+        "import pickle, sys\n"
+        "import gctree.isotyping as iso\n"
+        "isotype = iso.IsotypeTemplate(iso.default_isotype_order).new('IgG1')\n"
+        "hash(isotype)\n"
+        "sys.stdout.buffer.write(pickle.dumps({isotype: 1}))\n"
+    )
+    pickles = [
+        subprocess.run(
+            [sys.executable, "-c", script],
+            env=dict(os.environ, PYTHONHASHSEED=seed),
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        for seed in ("1", "2")
+    ]
+    new = iso.IsotypeTemplate(iso.default_isotype_order).new("IgG1")
+    for data in pickles:
+        isotype_dict = pickle.loads(data)
+        old = next(iter(isotype_dict))
+        assert old == new
+        assert hash(old) == hash(new)
+        assert new in isotype_dict
+
+
+def write_file(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_read_map_files(tmp_path):
+    empty = write_file(tmp_path, "empty.csv", "")
+    assert iso._read_isotypemap(empty) == {}
+    assert iso._read_idmap(empty) == {}
+
+    # ids are read verbatim, without missing value conversion
+    isotypemap_file = write_file(
+        tmp_path, "isotypemap.csv", "NA, IgG1\nnan,IgA \n NULL,IgM\n"
+    )
+    assert iso._read_isotypemap(isotypemap_file) == {
+        "NA": "IgG1",
+        "nan": "IgA",
+        "NULL": "IgM",
+    }
+
+    idmap_file = write_file(
+        tmp_path,
+        "idmap.csv",
+        "seq1,NA:cell2:\nseq2,\nseq3,:\nseq4,cell4 \nNA,nan\n",
+    )
+    assert iso._read_idmap(idmap_file) == {
+        "seq1": {"NA", "cell2"},
+        "seq4": {"cell4"},
+        "NA": {"nan"},
+    }
+
+
+@pytest.mark.parametrize("text", ["a,b,c\n", "a\n", "a,b\n\nc,d\n"])
+def test_read_map_files_bad_lines(tmp_path, text):
+    filename = write_file(tmp_path, "bad.csv", text)
+    with pytest.raises(ValueError):
+        iso._read_isotypemap(filename)
+    with pytest.raises(ValueError):
+        iso._read_idmap(filename)
@@ -2,6 +2,8 @@ import gctree.branching_processes as bp
 import gctree.phylip_parse as pp
 import gctree.utils as utils
 
+import historydag as hdag
+import math
 import numpy as np
 from multiset import FrozenMultiset
 from oldcode import OldCollapsedTree, OldCollapsedForest
@@ -198,3 +200,40 @@ def test_recursion_depth():
     bp.CollapsedTree._max_ll_cache = {}
     with np.errstate(all="raise"):
         bp.CollapsedTree._ll_genotype(2, 500, 0.4, 0.6)
+
+
+def test_ll_genotype_compensated_sum():
+    """DAG log likelihoods use compensated summation, which agrees with an
+    exact sum more closely than naive summation"""
+    p, q = 0.4, 0.6
+    ll_dagfuncs = bp._ll_genotype_dagfuncs(p, q)
+    accum_func = ll_dagfuncs["accum_func"]
+
+    # catastrophic cancellation loses the small term in a naive sum
+    values = [1e16, 1.0, -1e16]
+    weights = [hdag.utils.FloatState(v, state=(v, 0.0)) for v in values]
+    assert sum(values) == 0.0
+    result = accum_func(weights)
+    total, compensation = result.state
+    assert compensation != 0.0
+    assert total + compensation == math.fsum(values) == 1.0
+    assert result == 1.0
+
+    # compensation terms of partial sums are carried through nested sums
+    nested = accum_func([accum_func(weights[:2]), weights[2]])
+    assert sum(nested.state) == 1.0
+
+    for forest in newforests:
+        for tree in forest._forest.get_trees():
+            edge_lls = [
+                ll_dagfuncs["edge_weight_func"](node, child).state[0]
+                for node in tree.preorder()
+                for child in node.children()
+            ]
+            exact = math.fsum(edge_lls)
+            naive = 0.0
+            for ll in edge_lls:
+                naive += ll
+            compensated = sum(tree.optimal_weight_annotate(**ll_dagfuncs).state)
+            assert abs(compensated - exact) <= abs(naive - exact)
+            assert np.isclose(compensated, exact, rtol=0, atol=1e-12)